@@ -1,7 +1,7 @@
 
 import sys
 from common import ExpectedError, SilentError, error
-from control import build, stop, dispose, dispose_image, execute, global_status
+from control import build, stop, dispose, dispose_image, execute, global_status, call_with_api_version_retry
 
 
 class Action:
@@ -12,6 +12,21 @@ class Action:
     DISPOSE_IMAGE = '-dispose-image'
 
 
+ACTION_OPTIONS: 'dict[str, str]' = {
+    '-d': Action.DISPOSE,
+    '-del': Action.DISPOSE,
+    '-delete': Action.DISPOSE,
+    '-del-img': Action.DISPOSE_IMAGE,
+    '-delete-img': Action.DISPOSE_IMAGE,
+    '-del-image': Action.DISPOSE_IMAGE,
+    '-delete-image': Action.DISPOSE_IMAGE,
+    '-s': Action.STOP,
+    '-stop': Action.STOP,
+    '-b': Action.BUILD,
+    '-build': Action.BUILD,
+}
+
+
 def run_action(command_name: str, action: str, args: list[str], quiet_mode: bool):
     if action == Action.EXECUTE:
         execute(command_name, args, quiet_mode)
@@ -29,7 +44,7 @@ def main(command_name: str = ''):
 
     try:
         if command_name == '':
-            global_status()
+            call_with_api_version_retry(global_status)
         else:
             quiet_mode: bool = False
             action: str = Action.EXECUTE
@@ -42,18 +57,12 @@ def main(command_name: str = ''):
                     arg = arg[1:]
                 if arg == '-q':
                     quiet_mode = True
-                elif arg in ('-d', '-del', '-delete'):
-                    action = Action.DISPOSE
-                elif arg in ('-del-img', '-delete-img', '-del-image', '-delete-image'):
-                    action = Action.DISPOSE_IMAGE
-                elif arg in ('-s', '-stop'):
-                    action = Action.STOP
-                elif arg in ('-b', '-build'):
-                    action = Action.BUILD
+                elif arg in ACTION_OPTIONS:
+                    action = ACTION_OPTIONS[arg]
                 else:
                     raise SilentError(f'Unknown option "{arg}".')
             args = sys.argv[arg_index:]
-            run_action(command_name, action, args, quiet_mode)
+            call_with_api_version_retry(run_action, command_name, action, args, quiet_mode)
     except ExpectedError as ex:
         if len(str(ex)) > 0:
             error(str(ex))
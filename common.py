@@ -3,12 +3,12 @@ import os
 import sys
 import json
 import hashlib
+import functools
 from pathlib import Path
 from textwrap import dedent
 
 root: Path = Path(__file__).parent.parent
 data_dir: Path = Path(__file__).parent / 'data'
-owner_hash: str = hashlib.sha256(str(Path(__file__).parent.resolve()).encode()).hexdigest()
 
 class ExpectedError(Exception):
     code: int
@@ -22,6 +22,10 @@ class SilentError(Exception):
         super().__init__(message)
         self.code = code
 
+@functools.lru_cache(maxsize=1)
+def owner_hash() -> str:
+    return hashlib.sha256(os.path.realpath(os.path.dirname(__file__)).encode()).hexdigest()
+
 class UninitializedClass:
     pass
 
@@ -44,32 +48,27 @@ def warning(text: str, details: 'str|None' = None):
 def error(text: str, details: 'str|None' = None):
     print(f'{C.Red}ERROR: {text}{C.N}', file=sys.stderr)
 
+@functools.lru_cache(maxsize=1)
 def get_bin_dirs() -> list[Path]:
-    def best_name(a: Path):
-        score = len(str(a)) + a[0] / 1000
-        if a[1].name in ('bin', 'sbin'): score -= 1000
-        if a[1].parent.name.endswith('local'): score -= 1000
-        return score
-    result: list[tuple[int, Path]] = []
+    scores: dict[Path, float] = {}
     prefix = str(Path.home().resolve()) + os.sep
-    for dirStr in os.environ['PATH'].split(':'):
+    for index, dirStr in enumerate(os.environ.get('PATH', '').split(os.pathsep)):
         try:
             dir = Path(dirStr).resolve()
         except:
             continue
-        if not str(dir).startswith(prefix): continue
-        if str(dir).find('env') >= 0: continue
-        result.append((len(result), dir))
-    if len(result) == 0:
+        dir_str = str(dir)
+        if not dir_str.startswith(prefix): continue
+        if 'env' in dir_str: continue
+        if dir in scores: continue
+        # Prefer short "bin" directories, keep PATH order otherwise
+        score = len(dir_str) + index / 1000
+        if dir.name in ('bin', 'sbin'): score -= 1000
+        if dir.parent.name.endswith('local'): score -= 1000
+        scores[dir] = score
+    if len(scores) == 0:
         raise FileNotFoundError("No bin directories in the home directory.") # TODO: Print how to solve it.
-    result.sort(key=best_name)
-    seen = set()
-    result2: list[Path] = []
-    for x in result:
-        if x[1] not in seen:
-            seen.add(x[1])
-            result2.append(x[1])
-    return result2
+    return sorted(scores, key=lambda dir: scores[dir])
 
 def get_command_path(name: str):
     dirs = get_bin_dirs()
@@ -84,23 +83,20 @@ def get_command_path(name: str):
 
 def create_command(name: str, script_file: 'Path|str', function_name: 'str|None', *parameters):
     script_file = Path(script_file)
+    script_path = script_file.absolute()
+    stem = script_file.stem
     code = dedent(f'''
         #!{sys.executable}
         #my-docker-generated#
         import sys
         import json
-        import importlib.util
-        sys.path.insert(0, '{script_file.absolute().parent}')
-        spec = importlib.util.spec_from_file_location('{script_file.stem}', '{Path(script_file).absolute()}')
-        if spec is None:
-            print(f'Required script file not found: {Path(script_file).absolute()}', file=sys.stderr)
-            exit(99)
-        mod = importlib.util.module_from_spec(spec)
-        sys.modules['{script_file.stem}'] = mod
-        if spec.loader is None:
-            print(f'Loader for script file not available: {Path(script_file).absolute()}', file=sys.stderr)
+        sys.path.insert(0, '{script_path.parent}')
+        try:
+            import {stem} as mod
+        except ModuleNotFoundError as ex:
+            if ex.name != '{stem}': raise
+            print('Required script file not found: {script_path}', file=sys.stderr)
             exit(99)
-        spec.loader.exec_module(mod)
     ''').strip() + '\n'
     if function_name is not None:
         code += f'mod.{function_name}(*json.loads("""{json.dumps(parameters)}"""))\n'
@@ -120,9 +116,12 @@ def create_command(name: str, script_file: 'Path|str', function_name: 'str|None'
             if file.exists():
                 if not file.is_file():
                     raise IOError(f'Cannot override "{name}" in directory "{str(dir)}".')
-                with open(file, 'rb') as f:
-                    head = f.read(512)
-                if head.count(b'\n#my-docker-generated#\n') == 0:
+                fd = os.open(file, os.O_RDONLY)
+                try:
+                    head = os.read(fd, 512)
+                finally:
+                    os.close(fd)
+                if b'\n#my-docker-generated#\n' not in head:
                     raise IOError(f'Cannot override file "{name}" that was not created by my-dockers tool in directory "{str(dir)}".')
             file.write_text(code, encoding='utf8')
             file.chmod(0o755)
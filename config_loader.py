@@ -1,6 +1,8 @@
 
+import os
 import re
 import sys
+import stat
 import yaml
 import traceback
 from pathlib import Path
@@ -8,8 +10,14 @@ from textwrap import dedent
 from types import SimpleNamespace
 from common import root, error, warning
 
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
-YAML_COMMENT = dedent('''
+
+# Initial content of the commands.yaml, dedented only when the file is created
+YAML_COMMENT = '''
     #
     # List of commands that will give you access to my-dockers containers.
     #
@@ -66,7 +74,11 @@ YAML_COMMENT = dedent('''
     #
     #     my-dockers
     #
-    ''').strip() + '\n\n\n'
+    '''
+
+
+COMMAND_NAME = re.compile(r'^[0-9a-z_](?:[0-9.a-z_-]*[0-9a-z_])?$', re.IGNORECASE)
+TOP_LEVEL_KEY = re.compile(r'([0-9a-z_][0-9.a-z_-]*):', re.IGNORECASE)
 
 
 class ConfigEntry:
@@ -82,17 +94,33 @@ class ConfigEntry:
 
 config: 'dict[str, ConfigEntry]' = {}
 
+PLAIN_DICT_ENTRIES = ('options', 'prompt', 'password')
+
+# File modes of checked paths, valid during a single configuration load
+path_mode_cache: 'dict[str, int | None]' = {}
+
+
+def get_path_mode(path: 'Path|str') -> 'int | None':
+    key = str(path)
+    if key not in path_mode_cache:
+        try:
+            path_mode_cache[key] = os.stat(key).st_mode
+        except (OSError, ValueError):
+            path_mode_cache[key] = None
+    return path_mode_cache[key]
+
 
 def validate_config_command(name, command):
     # Name is valid
-    if not re.match(r'^[0-9a-z_](?:[0-9.a-z_-]*[0-9a-z_])?$', name, re.IGNORECASE):
+    if not COMMAND_NAME.match(name):
         return f'Invalid command name: "{name}"'
     # Dockerfile entry exists and it is string
     if 'dockerfile' not in command or not isinstance(command['dockerfile'], str):
         return f'Invalid or missing "dockerfile" entry in "{name}".'
     # Dockerfile is existing file
     dockerfile: Path = root / command['dockerfile']
-    if not dockerfile.is_file():
+    mode = get_path_mode(dockerfile)
+    if mode is None or not stat.S_ISREG(mode):
         return f'Dockerfile "{dockerfile}" from "{name}" not found.'
     command['dockerfile'] = dockerfile
     # "share" is a list, empty by default
@@ -105,9 +133,9 @@ def validate_config_command(name, command):
     for dir in command['share']:
         if not isinstance(dir, str):
             return f'Expecting string or list of strings in "share" entry in "{name}".'
-        path = Path(dir)
-        if path.is_absolute() and path.is_dir():
-            new_share.append(path)
+        mode = get_path_mode(dir) if dir.startswith('/') else None
+        if mode is not None and stat.S_ISDIR(mode):
+            new_share.append(Path(dir))
         else:
             warning(f'Invalid share "{dir}" in "{name}".')
     command['share'] = new_share
@@ -145,6 +173,12 @@ def validate_config(config, config_text):
     if not isinstance(config, dict):
         error('Expected a dictionary at top level of commands.yaml.')
         return {}
+    # Line numbers of the top level keys
+    lines: 'dict[str, int]' = {}
+    for line_number, line in enumerate(config_text.split('\n'), start=1):
+        match = TOP_LEVEL_KEY.match(line)
+        if match is not None and match.group(1) not in lines:
+            lines[match.group(1)] = line_number
     new_config = {}
     for name, command in config.items():
         result = validate_config_command(name, command)
@@ -152,46 +186,48 @@ def validate_config(config, config_text):
             error(result)
         else:
             new_config[name] = command
-        parts = re.split(f'\n' + re.escape(name) + ':', config_text, 2)
-        if len(parts) > 1:
-            command['line'] = parts[0].count('\n') + 2
-        else:
-            command['line'] = None
+        command['line'] = lines.get(name)
     return new_config
 
 
+SEQUENCE_TYPES = (set, list, tuple)
+
+
 def dict_to_simple_namespace(input):
+    type_construct = type(input)
+    # Strings are the most common values, return them immediately
+    if type_construct is str:
+        return input
     if isinstance(input, dict):
         new_dict = {}
         for key, value in input.items():
             new_dict[key] = dict_to_simple_namespace(value)
         return SimpleNamespace(**new_dict)
-    type_construct = type(input)
-    if type_construct in (set, list, tuple):
+    if type_construct in SEQUENCE_TYPES:
         return type_construct([dict_to_simple_namespace(x) for x in input])
     else:
         return input
 
 
 def load_config():
+    path_mode_cache.clear()
     yaml_file = root / 'commands.yaml'
     if not yaml_file.exists():
-        yaml_file.write_text(YAML_COMMENT)
+        yaml_file.write_text(dedent(YAML_COMMENT).strip() + '\n\n\n')
     try:
-        with open(yaml_file, 'r') as fd:
-            config_raw = yaml.load(fd, Loader=yaml.FullLoader)
-        with open(yaml_file, 'r') as fd:
-            config_text = fd.read()
+        config_text = yaml_file.read_text()
+        config_raw = yaml.load(config_text, Loader=YamlLoader)
         if config_raw is None:
             print(f'No commands detected. Edit configuration in:\n{yaml_file}', file=sys.stderr)
             config_raw = {}
         config_raw = validate_config(config_raw, config_text)
         config.clear()
-        for key in config_raw.keys():
-            config[key] = dict_to_simple_namespace(config_raw[key])
-            config[key].options = config_raw[key]['options']
-            config[key].prompt = config_raw[key]['prompt']
-            config[key].password = config_raw[key]['password']
+        for key, command in config_raw.items():
+            # Those entries stay plain dictionaries, so do not convert them
+            plain_entries = { name: command.pop(name) for name in PLAIN_DICT_ENTRIES }
+            config[key] = dict_to_simple_namespace(command)
+            for name, value in plain_entries.items():
+                setattr(config[key], name, value)
     except BaseException as ex:
         error(f'Cannot parse yaml file: {ex}', traceback.format_exc())
         raise
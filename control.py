@@ -1,28 +1,123 @@
 
+import io
 import os
 import sys
-import re
 import pwd
+import json
 import traceback
 import subprocess
 import grp
 import hashlib
 import time
+import functools
 import docker
+import tarfile
+import threading
 import tempfile
 from getpass import getpass
+from concurrent.futures import ThreadPoolExecutor
 from docker.models.images import Image
 from docker.models.containers import Container
 from pathlib import Path
 from textwrap import dedent
-from git import Repo
-from git.exc import InvalidGitRepositoryError
-from git.diff import Diff
 from common import error, warning, data_dir, ExpectedError, SilentError, UninitializedClass, uninitialized, get_command_path, C, create_command, root
 from config_loader import load_config, ConfigEntry, config
 
 
-client = docker.from_env()
+docker_api_version_file: Path = data_dir / 'docker_api_version.json'
+
+
+def read_docker_api_versions() -> 'dict[str, str]':
+    try:
+        return json.loads(docker_api_version_file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_docker_api_versions(versions: 'dict[str, str]'):
+    try:
+        docker_api_version_file.write_text(json.dumps(versions, indent=4))
+    except OSError:
+        pass
+
+
+def create_client() -> docker.DockerClient:
+    # Reuse API version negotiated in the previous run to skip the "/version" request
+    docker_host = os.environ.get('DOCKER_HOST', '')
+    versions = read_docker_api_versions()
+    if docker_host in versions:
+        return docker.from_env(version=versions[docker_host], max_pool_size=16)
+    result = docker.from_env(max_pool_size=16)
+    versions[docker_host] = result.api.api_version
+    write_docker_api_versions(versions)
+    return result
+
+
+def is_api_version_error(ex: docker.errors.APIError) -> bool:
+    # The daemon responds with e.g. "client version 1.43 is too old. Minimum supported API version is 1.44"
+    return ex.status_code == 400 and 'client version' in str(ex.explanation).lower()
+
+
+def call_with_api_version_retry(func, *args):
+    # The cached API version may be rejected after the daemon was upgraded or downgraded,
+    # negotiate it again and repeat the call. The version is checked by the first request,
+    # so nothing was done yet.
+    global client
+    try:
+        return func(*args)
+    except docker.errors.APIError as ex:
+        if not is_api_version_error(ex):
+            raise
+    versions = read_docker_api_versions()
+    versions.pop(os.environ.get('DOCKER_HOST', ''), None)
+    write_docker_api_versions(versions)
+    client.close()
+    client = create_client()
+    reload()
+    return func(*args)
+
+
+client = create_client()
+
+
+def get_labels(obj: 'Image | Container') -> 'dict[str, str]':
+    # Objects created from list responses (not inspected) keep labels at the top level
+    if 'Labels' in obj.attrs:
+        return obj.attrs['Labels'] or {}
+    return obj.labels
+
+def get_container_name(container: Container) -> str:
+    if container.name is not None:
+        return container.name
+    return container.attrs['Names'][0].lstrip('/')
+
+@functools.lru_cache(maxsize=None)
+def get_images_by_label(label_key: str) -> 'dict[str, list[Image]]':
+    # Use the list response directly, images.list() would inspect each image separately
+    images = [ client.images.prepare_model(attrs) for attrs in client.api.images(filters={ 'label': label_key }) ]
+    result: 'dict[str, list[Image]]' = {}
+    for img in images:
+        result.setdefault(get_labels(img).get(label_key), []).append(img)
+    return result
+
+@functools.lru_cache(maxsize=None)
+def get_containers_by_label(label_key: str) -> 'dict[str, list[Container]]':
+    containers = client.containers.list(all=True, filters={ 'label': label_key }, sparse=True)
+    result: 'dict[str, list[Container]]' = {}
+    for container in containers:
+        result.setdefault(get_labels(container).get(label_key), []).append(container)
+    return result
+
+def prefetch_cache():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        images = executor.submit(get_images_by_label, 'my_dockers_name')
+        containers = executor.submit(get_containers_by_label, 'my_dockers_name')
+        images.result()
+        containers.result()
+
+def invalidate_cache():
+    get_images_by_label.cache_clear()
+    get_containers_by_label.cache_clear()
 
 
 commands: 'dict[str, Command]' = {}
@@ -60,7 +155,7 @@ class Command:
     line: int | None
     container: UninitializedClass | Container | None = uninitialized
     image: UninitializedClass | Image | None = uninitialized
-    sources_hash: UninitializedClass | str = uninitialized
+    sources_state: 'UninitializedClass | SourcesState' = uninitialized
 
     def __init__(self, name: str, command_config: ConfigEntry):
         self.name = name
@@ -80,7 +175,7 @@ class Command:
     def get_image(self) -> Image | None:
         if self.image is not uninitialized:
             return self.image
-        images = client.images.list(filters={ 'label': f'my_dockers_name={self.name}' })
+        images = get_images_by_label('my_dockers_name').get(self.name, [])
         images = [ img for img in images if len(img.tags) > 0 ]
         if len(images) == 0:
             self.image = None
@@ -95,7 +190,7 @@ class Command:
     def get_container(self) -> Container | None:
         if self.container is not uninitialized:
             return self.container
-        containers = client.containers.list(all=True, filters={'label': [ f'my_dockers_name={self.name}' ]})
+        containers = get_containers_by_label('my_dockers_name').get(self.name, [])
         if len(containers) == 0:
             self.container = None
         else:
@@ -104,64 +199,236 @@ class Command:
             self.container = containers[0]
         return self.container
 
+    def get_sources_state(self) -> 'SourcesState':
+        if self.sources_state is uninitialized:
+            st = self.dockerfile.stat()
+            self.sources_state = scan_sources(self.dockerfile, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size,
+                                              self.append, self.prebuild, self.postbuild)
+        return self.sources_state
+
+    def get_sources_fingerprint(self) -> 'str|None':
+        return self.get_sources_state().fingerprint
+
     def get_sources_hash(self) -> str:
-        if self.sources_hash is not uninitialized:
-            return self.sources_hash
+        state = self.get_sources_state()
+        if state.sources_hash is not None:
+            return state.sources_hash
+        fingerprint = state.fingerprint
+        # Reuse the previous result if none of the files changed since then
+        cached = read_sources_hash_cache(self.name) if fingerprint is not None else {}
+        if cached.get('fingerprint') == fingerprint and 'hash' in cached:
+            state.sources_hash = cached['hash']
+            return state.sources_hash
+        # Digests of the files from the previous run, keyed by path: [ size, mtime_ns, digest ]
+        cached_files: 'dict[str, list]' = cached.get('files', {})
+        new_files: 'dict[str, list]' = {}
         hash = hashlib.sha256()
         # Hash docker file (without empty lines)
-        cnt = self.dockerfile.read_bytes()
-        cnt = re.sub(rb'(\r?\n)(?:\s*(?:#[^\r\n]*)?\r?\n)+', b'\\1', cnt)
-        cnt = cnt.strip()
-        hash.update(cnt)
+        hash.update(read_dockerfile_content(self.dockerfile))
         # Hash docker file extended
         hash.update(self.append.encode())
         hash.update(self.prebuild.encode())
         hash.update(self.postbuild.encode())
-        # Hash rest of the files based on git status
+        # Hash checked out commit
+        if state.head is not None:
+            hash.update(state.head)
         try:
-            # Create Repo object
-            repo = Repo(self.dockerfile.parent, search_parent_directories=True)
-            repo_root = Path(repo.working_dir)
-            # Get checked out commit and hash its hash
-            for commit in repo.iter_commits():
-                break
-            else:
-                warning(f'Could not find any commit for "{self.dockerfile}".')
-            hash.update(commit.binsha)
-            # Get all touched and untracked files
-            files_set: set[str] = set()
-            files_set.update(repo.untracked_files)
-            for base in (None, commit):
-                for item in repo.index.diff(base):
-                    item: Diff
-                    if item.a_path is not None: files_set.add(item.a_path)
-                    if item.b_path is not None: files_set.add(item.b_path)
-            # Skip other docker files
-            files = [ file for file in files_set if not file.lower().endswith('.dockerfile') ]
-            # Sort to make the results consistent
-            files.sort()
             # hash changed and untracked files
-            for file in files:
+            for file in state.files:
                 hash.update(b'<<<' + file.encode())
-                file_path = Path(repo_root / file)
-                if file_path.exists():
-                    hash.update(b'+>>>')
-                    with open(file_path, 'rb') as fd:
-                        while True:
-                            chunk = fd.read(1024 * 1024)
-                            if len(chunk) == 0: break
-                            hash.update(chunk)
-                else:
+                file_path = state.repo_root / file
+                try:
+                    st = file_path.stat()
+                except (FileNotFoundError, NotADirectoryError):
                     hash.update(b'!>>>')
-        except InvalidGitRepositoryError as ex:
-            warning(f'File "{self.dockerfile}" is not tracked by the git. The "up to date" state may be inaccurate.', traceback.format_exc())
+                    continue
+                hash.update(b'+>>>')
+                # Hash only files that changed since the previous run
+                entry = cached_files.get(file)
+                if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+                    entry = [ st.st_size, st.st_mtime_ns, get_file_digest(file_path).hex() ]
+                new_files[file] = entry
+                hash.update(bytes.fromhex(entry[2]))
         except BaseException as ex:
+            fingerprint = None
             error(f'Unknown error when getting repository state: {ex}', traceback.format_exc())
-        self.sources_hash = hash.hexdigest()
-        return self.sources_hash
+        state.sources_hash = hash.hexdigest()
+        if fingerprint is not None:
+            write_sources_hash_cache(self.name, { 'fingerprint': fingerprint, 'hash': state.sources_hash, 'files': new_files })
+        return state.sources_hash
+
+    def is_image_up_to_date(self, image: Image) -> bool:
+        # Matching fingerprint means that nothing changed since the build, so skip hashing the files
+        fingerprint = self.get_sources_fingerprint()
+        labels = get_labels(image)
+        if fingerprint is not None and labels.get('my_dockers_fingerprint') == fingerprint:
+            return True
+        return labels.get('my_dockers_hash') == self.get_sources_hash()
+
+
+class SourcesState:
+
+    repo_root: 'Path | None' = None
+    head: 'bytes | None' = None
+    files: 'list[str]'
+    fingerprint: 'str | None' = None
+    sources_hash: 'str | None' = None
+
+    def __init__(self):
+        self.files = []
+
+
+@functools.lru_cache(maxsize=256)
+def scan_sources(dockerfile: Path, dev: int, inode: int, mtime_ns: int, size: int,
+                 append: str, prebuild: str, postbuild: str) -> 'SourcesState':
+    # The fingerprint uses only the Dockerfile path and metadata, its content is read only when the full hash is needed.
+    # Files from the same checkout often have the same mtime and size, so the path and inode identify the Dockerfile.
+    state = SourcesState()
+    hash = hashlib.sha256()
+    hash.update(f'{dockerfile}<<<{dev}:{inode}:{mtime_ns}:{size}>>>'.encode())
+    hash.update(append.encode())
+    hash.update(prebuild.encode())
+    hash.update(postbuild.encode())
+    # Get rest of the files based on git status
+    try:
+        repo_root = get_repo_root(dockerfile.parent)
+        if repo_root is None:
+            warning(f'File "{dockerfile}" is not tracked by the git. The "up to date" state may be inaccurate.')
+            return state
+        state.repo_root = repo_root
+        # Get checked out commit and hash its hash
+        with get_repo_status_lock(repo_root):
+            head, files = get_repo_status(repo_root)
+        state.head = head
+        if head is not None:
+            hash.update(head)
+        else:
+            warning(f'Could not find any commit for "{dockerfile}".')
+        # Cheap fingerprint of the sources based on the files metadata
+        state.fingerprint = get_files_fingerprint(hash, repo_root, files)
+        state.files = files
+    except BaseException as ex:
+        error(f'Unknown error when getting repository state: {ex}', traceback.format_exc())
+    return state
+
+
+@functools.lru_cache(maxsize=None)
+def get_repo_root(dir: Path) -> 'Path | None':
+    res = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=dir, capture_output=True, encoding='utf-8')
+    if res.returncode != 0:
+        return None
+    return Path(res.stdout.rstrip('\n'))
+
+
+# Makes commands from the same repository wait for a single "git status" call,
+# commands from different repositories are not blocked by each other
+repo_status_locks: 'dict[Path, threading.Lock]' = {}
+repo_status_locks_guard = threading.Lock()
+
+
+def get_repo_status_lock(repo_root: Path) -> threading.Lock:
+    with repo_status_locks_guard:
+        if repo_root not in repo_status_locks:
+            repo_status_locks[repo_root] = threading.Lock()
+        return repo_status_locks[repo_root]
+
+
+@functools.lru_cache(maxsize=None)
+def get_repo_status(repo_root: Path) -> 'tuple[bytes | None, list[str]]':
+    # Shared by all commands from the same repository, returns binary HEAD commit hash and changed files
+    res = subprocess.run(['git', 'rev-parse', '--verify', '-q', 'HEAD'], cwd=repo_root, capture_output=True, encoding='utf-8')
+    head = bytes.fromhex(res.stdout.strip()) if res.returncode == 0 else None
+    # Get all touched and untracked files, skip other docker files
+    pathspec = [ ':(exclude,icase)*.dockerfile' ]
+    # Skip also cache files of this script, they change on each run, so the hash would never be stable
+    try:
+        data_dir_relative = data_dir.resolve().relative_to(repo_root.resolve())
+        pathspec.append(':(exclude,literal)' + data_dir_relative.as_posix())
+    except ValueError:
+        pass
+    res = subprocess.run(['git', 'status', '--porcelain=v1', '-uall', '-z', '--', *pathspec],
+                         cwd=repo_root, capture_output=True, encoding='utf-8', check=True)
+    files_set: set[str] = set()
+    records = iter(res.stdout.split('\0'))
+    for record in records:
+        if len(record) < 4: continue
+        files_set.add(record[3:])
+        # Renamed and copied entries are followed by the original path
+        if 'R' in record[:2] or 'C' in record[:2]:
+            files_set.add(next(records))
+    # Sort to make the results consistent
+    files = sorted(files_set)
+    return head, files
+
+
+def read_dockerfile_content(dockerfile: Path) -> bytes:
+    lines: list[bytes] = []
+    with open(dockerfile, 'rb') as fd:
+        for line in fd:
+            # Skip empty and comment-only lines, the first line is always kept
+            if len(lines) > 0 and line.endswith(b'\n'):
+                stripped = line.strip()
+                if len(stripped) == 0 or stripped.startswith(b'#'):
+                    continue
+            lines.append(line)
+    return b''.join(lines).strip()
+
+
+def get_file_digest(file_path: Path) -> bytes:
+    # The files are read instead of mapped, because they may be truncated while they are hashed
+    # (e.g. build outputs or logs) and accessing truncated mapped pages kills the process with SIGBUS.
+    with open(file_path, 'rb') as fd:
+        # The file is read once from start to end, so let the kernel read ahead aggressively
+        try:
+            os.posix_fadvise(fd.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            pass
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+, reads directly into a reused buffer
+            return hashlib.file_digest(fd, 'sha256').digest()
+        hash = hashlib.sha256()
+        while True:
+            chunk = fd.read(4 * 1024 * 1024)
+            if len(chunk) == 0: break
+            hash.update(chunk)
+        return hash.digest()
+
+
+def get_files_fingerprint(hash, repo_root: Path, files: list[str]) -> str:
+    for file in files:
+        hash.update(b'<<<' + file.encode())
+        try:
+            st = (repo_root / file).stat()
+            hash.update(f'+{st.st_mtime_ns}:{st.st_size}>>>'.encode())
+        except (FileNotFoundError, NotADirectoryError):
+            hash.update(b'!>>>')
+    return hash.hexdigest()
+
+
+def read_sources_hash_cache(command_name: str) -> dict:
+    try:
+        return json.loads((data_dir / f'{command_name}.hash.json').read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_sources_hash_cache(command_name: str, cache: dict):
+    # Write to a temporary file first, so concurrent runs never see a partially written cache
+    temp_name = None
+    try:
+        with tempfile.NamedTemporaryFile(mode='w', dir=data_dir, prefix=f'{command_name}.', suffix='.tmp', delete=False) as temp_file:
+            temp_name = temp_file.name
+            json.dump(cache, temp_file, indent=4)
+        os.replace(temp_name, data_dir / f'{command_name}.hash.json')
+    except OSError:
+        try:
+            if temp_name is not None: os.unlink(temp_name)
+        except:
+            pass
 
 
 def reload():
+    invalidate_cache()
     load_config()
     commands.clear()
     for command_name, command_config in config.items():
@@ -188,20 +455,22 @@ def run_bash_script(script: str, env: 'dict[str, str]'):
         return
     new_env = os.environ.copy()
     new_env.update(env)
-    name = None
-    with tempfile.NamedTemporaryFile(mode='w+t', delete=False) as temp_file:
-        temp_file.write(f'#/bin/bash\nset -e\n{script}\n')
-        temp_file.close()
-        name = Path(temp_file.name)
-        name.chmod(0o755)
-        res = subprocess.run(['bash', str(name)], env=new_env)
-    try:
-        if name is not None: name.unlink()
-    except:
-        pass
+    # Pass the script as an argument, so it does not need a temporary file and keeps stdin for the user
+    res = subprocess.run(['bash', '-c', f'set -e\n{script}\n', 'bash'], env=new_env)
     if res.returncode != 0:
         raise ExpectedError(f'Pre-build or post-build script failed with code {res.returncode}.', res.returncode)
 
+@functools.lru_cache(maxsize=None)
+def get_user_name(uid: int) -> str:
+    # User and group lookups may be slow when they go to the network (LDAP, SSSD)
+    return pwd.getpwuid(uid).pw_name
+
+
+@functools.lru_cache(maxsize=None)
+def get_group_name(gid: int) -> str:
+    return grp.getgrgid(gid).gr_name
+
+
 def build(command_name: str, quiet_mode: bool):
     command = get_command(command_name)
     old_image = command.get_image()
@@ -239,29 +508,69 @@ def build(command_name: str, quiet_mode: bool):
         secret_kwargs['env'][f'MY_DOCKER_SECRET_{key}'] = value
         script_vars[f'PASSWORD_{key}'] = value
     run_bash_script(command.prebuild, script_vars)
+    if command.prebuild:
+        # Pre-build script may modify the sources, so scan them again
+        scan_sources.cache_clear()
+        get_repo_status.cache_clear()
+        command.sources_state = uninitialized
     res = subprocess.run([
         'docker', 'buildx', 'build',
         '-f', str(dockerfile),
         '-t', command.get_tag(),
         '--label', f'my_dockers_name={command.name}',
         '--label', f'my_dockers_hash={command.get_sources_hash()}',
+        '--label', f'my_dockers_fingerprint={command.get_sources_fingerprint() or ""}',
         '--build-arg', f'UI={os.getuid()}',
-        '--build-arg', f'UN={pwd.getpwuid(os.getuid()).pw_name}',
+        '--build-arg', f'UN={get_user_name(os.getuid())}',
         '--build-arg', f'GI={os.getgid()}',
-        '--build-arg', f'GN={grp.getgrgid(os.getgid()).gr_name}',
+        '--build-arg', f'GN={get_group_name(os.getgid())}',
         *prompt_args,
         '.'
     ], cwd=command.dockerfile.parent, **secret_kwargs)
     if res.returncode != 0:
         raise ExpectedError(f'Build failed with code {res.returncode}.', res.returncode)
     run_bash_script(command.postbuild, script_vars)
+    invalidate_cache()
+    command.image = uninitialized
     new_image = command.get_image()
     if old_container is not None:
         old_container.remove(force=True)
-    if old_image is not None and new_image.id != old_image.id:
+    if old_image is not None and new_image is not None and new_image.id != old_image.id:
         old_image.remove(force=True)
 
-def start(command_name: str, quiet_mode: bool):
+@functools.lru_cache(maxsize=1)
+def get_start_script_archive() -> bytes:
+    data = (Path(__file__).parent / 'my-dockers-start').read_bytes()
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        info = tarfile.TarInfo('my-dockers-start')
+        info.size = len(data)
+        info.mode = 0o755
+        tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+def wait_while_restarting(container: Container, timeout: int = 30):
+    if container.status != ContainerStatus.RESTARTING:
+        return
+    now = int(time.time())
+    events = client.events(since=now, until=now + timeout, filters={ 'container': container.id }, decode=True)
+    try:
+        # Status may have changed before the events stream was opened
+        container.reload()
+        if container.status == ContainerStatus.RESTARTING:
+            for event in events:
+                if event.get('Action') == 'destroy':
+                    raise ExpectedError('The container was removed while restarting.')
+                if event.get('Action') in ('start', 'die'):
+                    break
+            else:
+                # The stream ended without any state change
+                raise ExpectedError(f'The container is still restarting after {timeout} seconds.')
+            container.reload()
+    finally:
+        events.close()
+
+def start(command_name: str, quiet_mode: bool) -> Container:
     command = get_command(command_name)
     image = command.get_image()
     if image is None:
@@ -285,17 +594,9 @@ def start(command_name: str, quiet_mode: bool):
             labels={ 'my_dockers_name': command.name },
             **command.options
             )
-        subprocess.run([
-            'docker', 'cp',
-            str((Path(__file__).parent / 'my-dockers-start').absolute()),
-            container.id + ':/usr/bin/my-dockers-start',
-        ], check=True)
-        container.exec_run(['chmod', '+x', '/usr/bin/my-dockers-start'])
-
-    retry_count = 30
-    while container.status == ContainerStatus.RESTARTING and retry_count > 0:
-        time.sleep(300)
-        retry_count -= 1
+        container.put_archive('/usr/bin', get_start_script_archive())
+
+    wait_while_restarting(container)
 
     if container.status == ContainerStatus.RUNNING:
         pass # Nothing to do, already running
@@ -305,6 +606,8 @@ def start(command_name: str, quiet_mode: bool):
         container.unpause()
     else: # container.status in (restarting, removing, dead):
         raise ExpectedError(f'The container is {container.status}. Cannot be started now.')
+    invalidate_cache()
+    return container
 
 
 def stop(command_name: str, quiet_mode: bool):
@@ -313,15 +616,12 @@ def stop(command_name: str, quiet_mode: bool):
     if container is None:
         return
 
-    retry_count = 30
-    while container.status == ContainerStatus.RESTARTING and retry_count > 0:
-        time.sleep(300)
-        retry_count -= 1
-
     if container.status == ContainerStatus.PAUSED:
         container.unpause()
-    if container.status in (ContainerStatus.RUNNING, ContainerStatus.PAUSED):
+    # Do not wait for a restarting container, it may be crash looping, stop it directly
+    if container.status in (ContainerStatus.RUNNING, ContainerStatus.PAUSED, ContainerStatus.RESTARTING):
         container.stop(timeout=1)
+    invalidate_cache()
 
 
 def dispose(command_name: str, quiet_mode: bool):
@@ -337,6 +637,7 @@ def dispose(command_name: str, quiet_mode: bool):
         if response == 'n':
             raise SilentError('Canceled by user.')
     container.remove(force=True)
+    invalidate_cache()
 
 def dispose_image(command_name: str, quiet_mode: bool):
     dispose(command_name, quiet_mode)
@@ -345,17 +646,14 @@ def dispose_image(command_name: str, quiet_mode: bool):
     image = command.get_image()
     if image is not None:
         image.remove(force=True)
+        invalidate_cache()
 
 def execute(command_name: str, args: list[str], quiet_mode: bool):
     command = get_command(command_name)
     container = command.get_container()
     if container is None or container.status != ContainerStatus.RUNNING:
-        start(command_name, quiet_mode)
-        reload()
-        command = get_command(command_name)
-        container = command.get_container()
-        if container is None:
-            raise ExpectedError(f'Cannot find container associated with command "{command_name}".')
+        # The started container is used directly, no need to look it up again
+        container = start(command_name, quiet_mode)
     if len(args) == 0:
         args = [ 'bash' ]
     run_args = [
@@ -370,8 +668,16 @@ def execute(command_name: str, args: list[str], quiet_mode: bool):
     if res.returncode != 0:
         raise SilentError('', res.returncode)
 
+def is_command_up_to_date(command: Command) -> bool:
+    image = command.get_image()
+    return image is None or command.is_image_up_to_date(image)
+
 def print_status():
+    prefetch_cache()
     print(f'\nConfiguration file: {root / "commands.yaml"}')
+    # Hashing sources is I/O bound (git and file reads), so check all commands concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(commands)))) as executor:
+        up_to_date = dict(zip(commands.keys(), executor.map(is_command_up_to_date, commands.values())))
     commands_to_update = []
     for command in commands.values():
         print()
@@ -379,13 +685,13 @@ def print_status():
         # Container
         container = command.get_container()
         if container is not None:
-            print(f'        Container:  {pretty_status[container.status] if container.status in pretty_status else container.status} {container.short_id} {container.name}')
+            print(f'        Container:  {pretty_status[container.status] if container.status in pretty_status else container.status} {container.short_id} {get_container_name(container)}')
         else:
             print(f'        Container:  {C.Yellow}[Deleted]{C.N}')
         # Image
         image = command.get_image()
         if image is not None:
-            if 'my_dockers_hash' not in image.labels or image.labels['my_dockers_hash'] != command.get_sources_hash():
+            if not up_to_date[command.name]:
                 print(f'        Image:      {C.Red}[Outdated]{C.N} {image.short_id} {", ".join(image.tags)}')
                 commands_to_update.append(command.name)
             else:
@@ -453,4 +759,4 @@ reload()
 
 
 if __name__ == '__main__':
-    global_status()
+    call_with_api_version_retry(global_status)